@@ -1,71 +1,246 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+import functools
 from heapq import merge
 from dateutil.relativedelta import relativedelta
 import requests
-import shutil
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from logbook import Logger
+from pathlib import Path
 import logbook
 from zipfile import ZipFile
-import time
 import os
+import io
 import itertools
-import re
+import json
+import threading
 
 
 log = Logger('binance_data.py', level=logbook.INFO)
 
 columns = ['Open time', 'Open', 'High', 'Low', 'Close', 'Volume', 'Close time', 'Quote asset volume', 'Number of trades', 'Taker buy base asset volume', 'Taker buy quote asset volume', 'Ignore']
 
+# 固定列类型, 省去 pandas 的类型推断
+dtypes = {
+    'Open time': 'int64',
+    'Open': 'float64',
+    'High': 'float64',
+    'Low': 'float64',
+    'Close': 'float64',
+    'Volume': 'float64',
+    'Close time': 'int64',
+    'Quote asset volume': 'float64',
+    'Number of trades': 'int32',
+    'Taker buy base asset volume': 'float64',
+    'Taker buy quote asset volume': 'float64',
+}
+
+# 最后一列 Ignore 恒为 0, 解析时直接跳过
+usecols = columns[:11]
+
+# 合并输出为 parquet 时的表结构, 时间戳保持毫秒 int64, 与 csv 输出一致
+kline_schema = pa.schema([(name, pa.from_numpy_dtype(np.dtype(dtype))) for name, dtype in dtypes.items()])
+
+# 低精度模式: 浮点列用 float32, 数据量和内存减半; 默认保持 float64 以便精确回放
+low_precision_dtypes = {name: 'float32' if dtype == 'float64' else dtype for name, dtype in dtypes.items()}
+low_precision_schema = pa.schema([(name, pa.from_numpy_dtype(np.dtype(dtype))) for name, dtype in low_precision_dtypes.items()])
+
+# parquet 列编码: 时间戳间隔固定, 差分编码后几乎不占空间; 浮点数按字节拆分后 zstd 压缩率更高
+parquet_options = dict(
+    compression='zstd',
+    use_dictionary=False,
+    column_encoding={
+        'Open time': 'DELTA_BINARY_PACKED',
+        'Close time': 'DELTA_BINARY_PACKED',
+        **{name: 'BYTE_STREAM_SPLIT' for name, dtype in dtypes.items() if dtype.startswith('float')},
+    },
+)
+
+# 各时间周期的毫秒数, 与毫秒时间戳直接比较; 1mo 长度不固定, 不在其中
+interval_ms = {
+    '1s': 1_000,
+    '1m': 60_000,
+    '3m': 3 * 60_000,
+    '5m': 5 * 60_000,
+    '15m': 15 * 60_000,
+    '30m': 30 * 60_000,
+    '1h': 3_600_000,
+    '2h': 2 * 3_600_000,
+    '4h': 4 * 3_600_000,
+    '6h': 6 * 3_600_000,
+    '8h': 8 * 3_600_000,
+    '12h': 12 * 3_600_000,
+    '1d': 86_400_000,
+    '3d': 3 * 86_400_000,
+    '1w': 7 * 86_400_000,
+}
+
+# 请求超时(连接, 读取)秒数, 避免单个月份卡住整个下载
+request_timeout = (10, 60)
+
+# 并发下载线程数, 下载纯属 I/O, 不受 GIL 影响
+max_workers = 16
+
+_local = threading.local()
+
+
+def get_session() -> requests.Session:
+    """
+    获取当前线程的 requests 会话, 复用连接, 遇到 429/5xx 时自动退避重试
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        retry = Retry(total=3, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        _local.session = session
+    return session
+
+
+@functools.lru_cache(maxsize=None)
+def kline_url_template(symbol, period):
+    """
+    月度K线文件下载地址模板, 按交易对和周期缓存
+    :param symbol: 交易对
+    :param period: 时间周期
+    """
 
-def download_spot_klines(symbol, period, date: datetime, path):
+    # https://data.binance.vision/data/spot/monthly/klines/ETHUSDT/1m/ETHUSDT-1m-2021-06.zip
+
+
+    # https://data.binance.vision/data/futures/cm/monthly/klines/AAVEUSD_PERP/
+
+    market = 'spot' if symbol.endswith('USDT') else 'futures/cm'
+    return 'https://data.binance.vision/data/%s/monthly/klines/%s/%s/%s-%s-' % (market, symbol, period, symbol, period) + '%s-%02d.zip'
+
+
+def kline_url(symbol, period, date: datetime):
     """
-    下载现货K线历史行情数据
+    月度K线文件下载地址
     :param symbol: 交易对
-    :param period: 时间周期，比如：1m, 3m, 5m, 15m, 30m, 1h, 2h, 4h, 6h, 8h, 12h, 1d, 3d, 1w, 1mo
+    :param period: 时间周期
     :param date: 日期
-    :param path: 文件保存路径
     """
+    return kline_url_template(symbol, period) % (date.year, date.month)
 
-    # https://data.binance.vision/data/spot/monthly/klines/ETHUSDT/1m/ETHUSDT-1m-2021-06.zip
 
+def read_sidecar(path) -> dict:
+    """
+    读取 zip 文件旁的 json 记录: url, etag, content_length, size, rows, first_ts, last_ts
+    :param path: zip文件路径
+    """
+    try:
+        with open(path + '.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    requests.adapters.DEFAULT_RETRIES = 10 # 增加重连次数
-    s = requests.session()
-    s.keep_alive = False # 关闭多余连接
 
+def write_sidecar(path, fresh=False, **info) -> dict:
+    """
+    更新 zip 文件旁的 json 记录
+    :param path: zip文件路径
+    :param fresh: 丢弃原有记录重新写入, 重新下载文件时使用
+    """
+    if not fresh:
+        info = {**read_sidecar(path), **info}
+    with open(path + '.json', 'w') as f:
+        json.dump(info, f)
+    return info
 
-    # https://data.binance.vision/data/futures/cm/monthly/klines/AAVEUSD_PERP/
 
-    if re.match(r'\w+USDT', symbol):
-        url = 'https://data.binance.vision/data/spot/monthly/klines/%s/%s/%s-%s-%s-%02d.zip' % (symbol, period, symbol, period, date.year, date.month)
-    else:
-        url = 'https://data.binance.vision/data/futures/cm/monthly/klines/%s/%s/%s-%s-%s-%02d.zip' % (symbol, period, symbol, period, date.year, date.month)
+def record_klines_stats(path, df) -> dict:
+    """
+    把 zip 文件大小, 行数和首尾时间戳写入记录, 之后校验时无需再解压
+    :param path: zip文件路径
+    :param df: 该文件解析出的K线数据
+    """
+    t = df['Open time']
+    return write_sidecar(path, size=os.path.getsize(path), rows=len(df),
+                         first_ts=int(t.iat[0]) if len(df) else None,
+                         last_ts=int(t.iat[-1]) if len(df) else None)
+
+
+def download_spot_klines(symbol, period, date: datetime, path):
+    """
+    下载现货K线历史行情数据
+    :param symbol: 交易对
+    :param period: 时间周期，比如：1m, 3m, 5m, 15m, 30m, 1h, 2h, 4h, 6h, 8h, 12h, 1d, 3d, 1w, 1mo
+    :param date: 日期
+    :param path: 文件保存路径
+    """
 
+    url = kline_url(symbol, period, date)
     log.info(url)
     try:
-        with s.get(url, stream=True) as r:
-            size = 0  # 已下载文件的大小
+        with get_session().get(url, stream=True, timeout=request_timeout) as r:
             chunk_size = 1024 * 1024  # 每次下载数据的大小:单位字节 1024:1KB 1024*1024:1MB
-            content_size = int(r.headers["content-length"])  # 文件总大小:单位字节
-            
+            content_size = int(r.headers.get("content-length", 0))  # 文件总大小:单位字节
+
             if r.status_code == 200:
-                with open(path, 'wb') as f:
-                    shutil.copyfileobj(r.raw, f)
+                # 无缓冲写入, 每次 1MB; 已知大小时预分配磁盘空间, 减少碎片
+                # 先写临时文件, 下载完整后再改名, 避免中断留下残缺文件被当成已下载
+                part_path = path + '.part'
+                try:
+                    with open(part_path, 'wb', buffering=0) as f:
+                        if content_size and hasattr(os, 'posix_fallocate'):
+                            os.posix_fallocate(f.fileno(), 0, content_size)
+                        written = 0
+                        while chunk := r.raw.read(chunk_size, decode_content=False):
+                            written += f.write(chunk)
+                        # 连接提前断开时 read 只会返回空, 需要自己核对字节数, 否则预分配的零填充尾部会被当成数据
+                        if content_size and written != content_size:
+                            raise IOError('incomplete download %d/%d bytes' % (written, content_size))
+                        os.ftruncate(f.fileno(), written)
+                    os.replace(part_path, path)
+                finally:
+                    # 下载失败时删除预分配的临时文件
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                # size 为实际收到的字节数, content_length 为响应头声明的大小(未知时为 None)
+                write_sidecar(path, fresh=True, url=url, etag=r.headers.get('etag'),
+                              content_length=content_size or None, size=written)
+            else:
+                # 上市前的月份返回 404, 读完响应体连接才会放回连接池复用, 否则会被直接关闭
+                log.info('%s %s' % (r.status_code, url))
+                r.raw.drain_conn()
     except Exception as e:
         log.warning('download error',e, path)
 
     return path
 
 
-def download_spot_klines_range(symbol, period, start: datetime, end: datetime, dir=''):
+def kline_months(start: datetime, end: datetime):
     """
-    下载指定时间范围的币安现货K线历史行情数据
+    按月遍历时间范围
+    :param start: 开始日期
+    :param end: 结束日期
+    """
+    while True:
+        yield start
+
+        start = start + relativedelta(months=+1)
+
+        if start > end:
+            break
+
+
+def kline_tasks(symbol, period, start: datetime, end: datetime, dir=''):
+    """
+    生成指定时间范围内尚未下载的K线文件任务
     :param symbol: 交易对
-    :param period: 时间周期，比如：1m, 3m, 5m, 15m, 30m, 1h, 2h, 4h, 6h, 8h, 12h, 1d, 3d, 1w, 1mo
+    :param period: 时间周期
     :param start: 开始日期
     :param end: 结束日期
     :param dir: 数据存放目录
+    :return: (symbol, period, date, path) 元组列表
     """
 
     # ETHUSDT/5m/ETHUSDT-5m-2017-11.zip
@@ -75,82 +250,348 @@ def download_spot_klines_range(symbol, period, start: datetime, end: datetime, d
 
     os.makedirs('%s%s/%s' % (dir, symbol, period), exist_ok=True)
 
-    while True:
+    tasks = []
+    for date in kline_months(start, end):
+
+        path = '%s%s/%s/%s-%s-%s-%02d.zip' % (dir, symbol, period, symbol, period, date.year, date.month)
 
-        path = '%s%s/%s/%s-%s-%s-%02d.zip' % (dir, symbol, period, symbol, period, start.year, start.month)
-        
-        print(path)
-        
         if not os.path.exists(path):
+            tasks.append((symbol, period, date, path))
+        else:
+            print('skip', path)
 
-            download_spot_klines(symbol, period, start, path)
+    return tasks
 
-            print('downloading...')
-            time.sleep(2)
 
-        else:
-            print('skip')
+def download_tasks(tasks, workers=max_workers):
+    """
+    并发下载K线文件
+    :param tasks: (symbol, period, date, path) 元组列表
+    :param workers: 下载线程数
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path in executor.map(lambda task: download_spot_klines(*task), tasks):
+            # 上市前的月份(404)和下载失败的文件不会写入磁盘
+            if os.path.exists(path):
+                print('downloaded', path)
 
-        start = start + relativedelta(months=+1)
 
-        if start > end:
-            break
+def download_spot_klines_range(symbol, period, start: datetime, end: datetime, dir=''):
+    """
+    下载指定时间范围的币安现货K线历史行情数据
+    :param symbol: 交易对
+    :param period: 时间周期，比如：1m, 3m, 5m, 15m, 30m, 1h, 2h, 4h, 6h, 8h, 12h, 1d, 3d, 1w, 1mo
+    :param start: 开始日期
+    :param end: 结束日期
+    :param dir: 数据存放目录
+    """
+    download_tasks(kline_tasks(symbol, period, start, end, dir))
+
+
+def read_klines_csv(file, low_precision=False) -> pd.DataFrame:
+    """
+    解析K线 csv 数据
+    :param file: csv 文件对象
+    :param low_precision: 浮点列直接解析为 float32
+    """
+    file = io.BufferedReader(file, buffer_size=1 << 20)
+    # 部分文件首行带表头(open_time,open,...), 需要跳过
+    skiprows = 0 if file.peek(1)[:1].isdigit() else 1
+    return pd.read_csv(file, header=None, names=columns, usecols=usecols, skiprows=skiprows,
+                       dtype=low_precision_dtypes if low_precision else dtypes,
+                       engine='c', na_filter=False, low_memory=False)
+
+
+def read_klines_stream(symbol, period, date: datetime, low_precision=False) -> pd.DataFrame:
+    """
+    下载月度K线文件并直接在内存中解压解析, 不写入磁盘
+    :param symbol: 交易对
+    :param period: 时间周期
+    :param date: 日期
+    :param low_precision: 浮点列使用 float32
+    :return: 文件不存在时返回 None; 超时, 内容不完整或解析出错时抛出异常
+    """
+    url = kline_url(symbol, period, date)
+    log.info(url)
+
+    r = get_session().get(url, timeout=request_timeout)
+    if r.status_code != 200:
+        log.warning('download error %s %s' % (r.status_code, url))
+        return None
+
+    with ZipFile(io.BytesIO(r.content)) as zf:
+        # 币安的 zip 里只有一个 csv 文件
+        with zf.open(zf.infolist()[0]) as file:
+            return read_klines_csv(file, low_precision)
 
-        
 
-def read_history_file(zip_file, csv_file) -> pd.DataFrame:
+def increasing_rows(t, last_ts=None):
+    """
+    时间戳严格大于之前所有行(以及 last_ts)的行, 用于去掉重复和乱序的K线
+    :param t: int64 毫秒时间戳数组
+    :param last_ts: 之前已写入的最大时间戳
+    :return: bool 数组
+    """
+    keep = np.ones(len(t), dtype=bool)
+    keep[1:] = t[1:] > np.maximum.accumulate(t)[:-1]
+    if last_ts is not None:
+        keep &= t > last_ts
+    return keep
+
+
+def stream_klines_range(symbol, period, start: datetime, end: datetime, output, workers=4, low_precision=False):
+    """
+    以流水线方式下载指定时间范围的K线并写入 parquet 文件, 不在磁盘保存 zip
+    下载解压解析在线程池中进行, 主线程按月份顺序写入; 同时最多 workers 个月的数据在途, 内存占用有上限
+    只跳过不存在的月份, 其他任何错误都会中止并丢弃临时文件, 不会输出缺月的文件
+    :param symbol: 交易对
+    :param period: 时间周期
+    :param start: 开始日期
+    :param end: 结束日期
+    :param output: parquet 文件输出路径
+    :param workers: 下载线程数, 也是在途月份数
+    :param low_precision: 浮点列使用 float32
+    """
+    schema = low_precision_schema if low_precision else kline_schema
+    last_ts = None
+
+    # 先写临时文件, 全部写完再改名, 出错时不会在 output 留下被截断的文件
+    part_path = output + '.part'
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+                pq.ParquetWriter(part_path, schema, **parquet_options) as writer:
+
+            def write(future):
+                nonlocal last_ts
+                df = future.result()
+                if df is None:
+                    return
+                keep = increasing_rows(df['Open time'].to_numpy(), last_ts)
+                if not keep.all():
+                    df = df[keep]
+                if len(df) > 0:
+                    writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+                    last_ts = df['Open time'].iat[-1]
+
+            pending = deque()
+            for date in kline_months(start, end):
+                pending.append(executor.submit(read_klines_stream, symbol, period, date, low_precision))
+                if len(pending) >= workers:
+                    write(pending.popleft())
+
+            while pending:
+                write(pending.popleft())
+
+        # 与 merge_sorted_klines 一致, 没有任何数据时不生成空文件
+        if last_ts is None:
+            raise Exception('NoData', 'no klines to merge')
+        os.replace(part_path, output)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+    return output
+
+
+def read_history_file(zip_file, low_precision=False) -> pd.DataFrame:
     """
     读取历史数据文件
     :param zip_file: zip文件路径
-    :param csv_file: csv文件路径
+    :param low_precision: 浮点列使用 float32
     """
-    # ETHUSDT-5m-2017-08.csv
+    # ETHUSDT-5m-2017-08.zip 里只有 ETHUSDT-5m-2017-08.csv 一个文件
     
     try:
         zf = ZipFile(zip_file)
-        file = zf.open(csv_file)
+        file = zf.open(zf.infolist()[0])
     except:
         raise Exception('BadZipFile', zip_file)
     
-    df = pd.read_csv(file, header=None, names=columns)
-    file.close()
-    zf.close()
+    try:
+        df = read_klines_csv(file, low_precision)
+    except Exception:
+        # 列类型固定后, 单元格格式错误会直接报错
+        raise Exception('BadCSV', zip_file)
+    finally:
+        file.close()
+        zf.close()
     return df
 
 
-def merge_history_file(dir, output) -> pd.DataFrame:
+def merge_sorted_klines(frames) -> pd.DataFrame:
     """
-    合并历史数据
+    合并各自按时间排好序的月度K线
+    月度文件的时间段互不重叠, 按首行时间戳排列后直接拼接即为有序,
+    再一次线性扫描去掉时间戳没有严格递增的重复行, 无需整体排序
+    :param frames: DataFrame 列表
+    """
+    frames = sorted((df for df in frames if len(df) > 0), key=lambda df: df['Open time'].iat[0])
+    if not frames:
+        raise Exception('NoData', 'no klines to merge')
+    # 各月列名和类型一致, 无需对齐排序列
+    merge_df = pd.concat(frames, ignore_index=True, sort=False)
+
+    keep = increasing_rows(merge_df['Open time'].to_numpy())
+    if not keep.all():
+        merge_df = merge_df[keep].reset_index(drop=True)
+    return merge_df
+
+
+def find_gaps(t, interval):
+    """
+    查找与上一根K线的时间间隔不等于 interval 的行号
+    :param t: int64 毫秒时间戳数组
+    :param interval: 周期毫秒数
+    """
+    return np.flatnonzero(np.diff(t) != interval) + 1
+
+
+try:
+    from numba import njit
+except ImportError:
+    pass
+else:
+    # numba 为可选依赖, 安装后用编译的循环扫描, 不分配整列的差分数组
+    @njit(cache=True)
+    def find_gaps(t, interval):
+        n = 0
+        for i in range(1, t.size):
+            if t[i] - t[i - 1] != interval:
+                n += 1
+        out = np.empty(n, dtype=np.int64)
+        k = 0
+        for i in range(1, t.size):
+            if t[i] - t[i - 1] != interval:
+                out[k] = i
+                k += 1
+        return out
+
+
+def check_klines(df, period):
+    """
+    检查合并后的K线数据: 非正价格, 最高价低于最低价, 时间间隔不连续
+    价格列只读取一次, 时间间隔直接在 int64 毫秒时间戳上计算
+    :param df: K线数据
+    :param period: 时间周期
+    """
+    ohlc = df[['Open', 'High', 'Low', 'Close']].to_numpy()
+    for name, bad in zip(['Open', 'High', 'Low', 'Close'], (ohlc <= 0).any(axis=0)):
+        if bad:
+            log.warning('%s has non-positive values' % name)
+
+    hl_bad = np.count_nonzero(ohlc[:, 1] < ohlc[:, 2])
+    if hl_bad:
+        log.warning('%d rows have High < Low' % hl_bad)
+
+    interval = interval_ms.get(period)
+    if interval is None:
+        # 1mo 等非固定长度周期不检查间隔
+        return
+
+    t = df['Open time'].to_numpy('int64')
+    gaps = find_gaps(t, interval)
+    if len(gaps):
+        log.warning('%d gaps in Open time, first at row %d' % (len(gaps), gaps[0]))
+
+
+def verify_history_file(dir, period, remote=False):
+    """
+    校验已下载的历史数据, 只读取每个 zip 旁的 json 记录
+    记录缺失或与文件大小不符时才解压读取该 zip, 并更新记录
     :param dir: 历史数据文件存放目录
-    :param output: 合并文件输出路径
+    :param period: 时间周期
+    :param remote: 是否带 If-None-Match 请求服务器, 检查文件是否有更新
+    :return: (实际行数, 按首尾时间戳推算的应有行数)
     """
-    merge_df = None
+    interval = interval_ms.get(period)
+
+    rows = expected = 0
+
+    for path in map(str, sorted(Path(dir).glob('*.zip'))):
+        size = os.path.getsize(path)
+        info = read_sidecar(path)
+
+        if info.get('content_length') and info['content_length'] != size:
+            log.warning('%s: %d bytes, expected %d' % (path, size, info['content_length']))
+
+        if info.get('size') != size or 'rows' not in info:
+            info = record_klines_stats(path, read_history_file(path))
+
+        if remote and info.get('url') and info.get('etag'):
+            r = get_session().head(info['url'], headers={'If-None-Match': info['etag']},
+                                    timeout=request_timeout)
+            if r.status_code != 304:
+                log.warning('%s changed on server (%s)' % (path, r.status_code))
 
-    for file in os.listdir(dir):
-        log.info('merge %s to %s' % (file, output))
+        rows += info['rows']
+        if interval and info['first_ts'] is not None:
+            expected += (info['last_ts'] - info['first_ts']) // interval + 1
 
-        df = read_history_file(dir + '/' + file, file.replace('.zip', '.csv'))
+    if interval and rows != expected:
+        log.warning('%s: %d rows, expected %d' % (dir, rows, expected))
 
-        merge_df = df if merge_df is None else pd.concat([merge_df, df])
-        merge_df = merge_df[merge_df['Open']!='open']
-    merge_df.to_csv(output, index=False)
+    return rows, expected
+
+
+def merge_history_file(dir, output, workers=None, period=None, low_precision=False) -> pd.DataFrame:
+    """
+    合并历史数据
+    :param dir: 历史数据文件存放目录
+    :param output: 合并文件输出路径, 以 .parquet 结尾时输出 parquet 文件
+    :param workers: 解压解析的进程数, 默认为 CPU 核数
+    :param period: 时间周期, 指定时检查合并后的数据
+    :param low_precision: 浮点列使用 float32
+    """
+    # 文件名以年月结尾, 排序后即为时间顺序
+    files = sorted(Path(dir).glob('*.zip'))
+
+    for file in files:
+        log.info('merge %s to %s' % (file.name, output))
+
+    # 解压和 csv 解析是 CPU 密集型, 按文件分发到多个进程, map 保持文件顺序
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        frames = list(executor.map(read_history_file, files, itertools.repeat(low_precision)))
+
+    # 顺带记录每个文件的行数和首尾时间戳, verify_history_file 之后只需读取记录
+    for file, df in zip(files, frames):
+        record_klines_stats(str(file), df)
+
+    # 循环结束后一次性合并, 避免每次 concat 都复制已合并的数据
+    merge_df = merge_sorted_klines(frames)
+    if period is not None:
+        check_klines(merge_df, period)
+    if output.endswith('.parquet'):
+        schema = low_precision_schema if low_precision else kline_schema
+        merge_df.to_parquet(output, engine='pyarrow', schema=schema, index=False, **parquet_options)
+    else:
+        merge_df.to_csv(output, index=False)
 
     return merge_df
 
 
-def download_symbol(symbol, period):
-    # 开始时间就这样, 没法更早了
-    download_spot_klines_range(symbol, period, start=datetime(2017, 10, 1), end=datetime(2022, 11, 10), dir=data_path)
+# 开始时间就这样, 没法更早了
+start_date = datetime(2017, 10, 1)
+end_date = datetime(2022, 11, 10)
+
+
+def merge_symbol(symbol, period):
     symbol_path = os.path.join(data_path, symbol, period)
     merge_file_path = os.path.join(data_path, symbol, '{}-{}.csv'.format(symbol, period))
     try:
-        merge_history_file(symbol_path, merge_file_path)
+        merge_history_file(symbol_path, merge_file_path, period=period)
+        # 合并时已写好每个 zip 的记录, 这里只读取记录核对文件大小和行数, 不再解压
+        verify_history_file(symbol_path, period)
     except Exception as inst:
         x, y = inst.args 
         print(x, y)
 
     return merge_file_path
 
+
+def download_symbol(symbol, period):
+    download_spot_klines_range(symbol, period, start=start_date, end=end_date, dir=data_path)
+    return merge_symbol(symbol, period)
+
 if __name__ == '__main__':
 
     base_path = os.path.abspath('.')
@@ -159,9 +600,11 @@ if __name__ == '__main__':
     symbols  = [ 'UNIUSDT', 'UNIUSD_PERP', ]#'DOTUSD_PERP', 'ETHUSD_PERP', 'BTCUSD_PERP', 'EOSUSDT', 'AAVEUSDT', 'ETCUSDT', 'ETHUSDT', 'UNIUSDT', 'BTCUSDT', 'XMRUSDT', 'XLMUSDT', 'BNBUSDT']
     periods  = ['1m','5m', '15m', '1h', '4h', '1d', '1w'] 
 
-    
+    # 所有交易对和周期的月度文件放进同一个线程池下载
+    tasks = []
+    for (symbol, period) in itertools.product(symbols, periods):
+        tasks += kline_tasks(symbol, period, start=start_date, end=end_date, dir=data_path)
+    download_tasks(tasks)
 
     for (symbol, period) in itertools.product(symbols, periods):
-        download_symbol(symbol, period)
-        time.sleep(5)
-    
+        merge_symbol(symbol, period)
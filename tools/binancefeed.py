@@ -1,6 +1,7 @@
 
 
 import backtrader as bt
+import numpy as np
 import pandas as pd
 # 创建一个新的数据源类，继承自 bt.feeds.PandasData
 class BinanceCSVData(bt.feeds.PandasData):
@@ -9,10 +10,46 @@ class BinanceCSVData(bt.feeds.PandasData):
 
     # 设置 'openinterest' 列的默认值为 0.0
     params = (('openinterest', 0.0),)
-    
+
+    def start(self):
+        super(BinanceCSVData, self).start()
+
+        # 开始前把各列一次性取成 numpy 数组, 回测主循环按下标取值, 不再逐格调用 DataFrame.iloc
+        df = self.p.dataname
+        self._columns = []
+        for datafield in self.getlinealiases():
+            if datafield == 'datetime':
+                continue
+            colindex = self._colmapping[datafield]
+            if colindex is None:
+                continue
+            self._columns.append((getattr(self.lines, datafield), df.iloc[:, colindex].to_numpy(dtype='float64')))
+
+        coldtime = self._colmapping['datetime']
+        dt = pd.DatetimeIndex(df.index if coldtime is None else df.iloc[:, coldtime])
+        if dt.tz is not None:
+            dt = dt.tz_convert(None)
+        # 与 backtrader 的 date2num 算法一致: 公历序数 + 当天时间的小数部分
+        self._dtnums = (dt.values.astype('datetime64[D]').astype('int64') + 719163
+                        + (dt.hour / 24.0 + dt.minute / 1440.0 + dt.second / 86400.0
+                           + dt.microsecond / 86400000000.0).to_numpy())
+
+    def _load(self):
+        self._idx += 1
+        if self._idx >= len(self._dtnums):
+            return False
+
+        for line, values in self._columns:
+            line[0] = values[self._idx]
+        self.lines.datetime[0] = self._dtnums[self._idx]
+        return True
+
 def load_csv(filepath):
     try:
-        df = pd.read_csv(filepath)
+        if filepath.endswith('.parquet'):
+            df = pd.read_parquet(filepath)
+        else:
+            df = pd.read_csv(filepath, engine='pyarrow')
     except FileNotFoundError:
         print(f"File {filepath} not found.")
         return None
@@ -22,8 +59,9 @@ def load_csv(filepath):
 
     try:
         df = df.rename(columns={'Open time': 'open_time', 'Close time': 'close_time', 'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume'})
-        df['open_time'] = pd.to_datetime(df['open_time'], unit='ms') + pd.Timedelta(hours=8)
-        df['close_time'] = pd.to_datetime(df['close_time'], unit='ms') + pd.Timedelta(hours=8)
+        # 毫秒时间戳直接按 datetime64[ms] 重新解释, 不走 pd.to_datetime
+        df['open_time'] = df['open_time'].to_numpy('int64').view('datetime64[ms]') + np.timedelta64(8, 'h')
+        df['close_time'] = df['close_time'].to_numpy('int64').view('datetime64[ms]') + np.timedelta64(8, 'h')
         df = df.set_index('open_time', drop=True)
     except Exception as e:
         print(f"Error occurred while processing data: {e}")